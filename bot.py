@@ -1,11 +1,21 @@
 import asyncio
+import atexit
+import contextvars
+import copy
 import json
 import logging
 import os
 import platform
+import queue
 import sqlite3
+import sys
+import threading
 import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 from threading import Thread
 
@@ -32,8 +42,109 @@ CHANNEL_ID = int(os.getenv("CHANNEL_ID"))
 ADMIN_ID = int(os.getenv("ADMIN_ID"))
 POSTING_INTERVAL_MINUTES = int(os.getenv("POSTING_INTERVAL_MINUTES", 60))  # По умолчанию 60 минут
 
+# Настройки логирования
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 5 * 1024 * 1024))  # По умолчанию 5 МБ на файл
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 3))
+LOG_TO_CONSOLE = os.getenv("LOG_TO_CONSOLE", "true").lower() == "true"
+
+# Идентификатор трассировки текущего запуска post_random_video
+current_trace_id = contextvars.ContextVar("trace_id", default="-")
+
+# Стандартные атрибуты LogRecord, которые не выводятся как дополнительные поля
+_LOG_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "trace_id"}
+
+
+class TraceIdFilter(logging.Filter):
+    """Добавляет в запись лога идентификатор трассировки из текущего контекста"""
+
+    def filter(self, record):
+        record.trace_id = current_trace_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись лога в одну строку JSON"""
+
+    def format(self, record):
+        payload = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "trace_id": getattr(record, "trace_id", "-"),
+            "message": record.getMessage(),
+        }
+        # Дополнительные поля, переданные через extra=
+        for key, value in vars(record).items():
+            if key not in _LOG_RECORD_ATTRS:
+                payload[key] = value
+        if record.exc_text:
+            payload["exc_info"] = record.exc_text
+        if record.stack_info:
+            payload["stack_info"] = record.stack_info
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class StructuredQueueHandler(QueueHandler):
+    """QueueHandler, который не вклеивает traceback в текст сообщения"""
+
+    def prepare(self, record):
+        # Стандартный prepare() форматирует запись целиком и обнуляет exc_info,
+        # поэтому traceback сохраняем отдельно в exc_text
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def setup_logging() -> QueueListener:
+    """Настраивает неблокирующее логирование через очередь и фоновый поток записи"""
+    handlers = []
+    if LOG_FILE:
+        file_handler = RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    if LOG_TO_CONSOLE:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(
+            logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s')
+        )
+        handlers.append(console_handler)
+
+    # Обработчики выполняются в отдельном потоке, поток событийного цикла только кладет запись в очередь
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(TraceIdFilter())
+
+    # Опечатка в LOG_LEVEL не должна мешать запуску бота
+    level = logging.getLevelName(LOG_LEVEL)
+    level_is_valid = isinstance(level, int)
+    if not level_is_valid:
+        level = logging.INFO
+
+    root_logger = logging.getLogger()
+    root_logger.handlers.clear()
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(level)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    if not level_is_valid:
+        logging.getLogger(__name__).warning(f"Некорректное значение LOG_LEVEL={LOG_LEVEL}, используется INFO")
+    return listener
+
+
 # Логирование
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
 # Инициализация
@@ -109,6 +220,141 @@ class DatabaseManager:
 DatabaseManager.init_db()
 
 
+class RunTrace:
+    """Трассировка одного запуска задачи: идентификатор и длительность этапов"""
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.stages = {}
+        self.current_stage = None  # Читается профайлером для привязки семплов к этапу
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Замеряет длительность этапа в секундах"""
+        previous_stage = self.current_stage
+        self.current_stage = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = round(time.perf_counter() - start, 3)
+            self.current_stage = previous_stage
+
+    @property
+    def total(self) -> float:
+        return round(time.perf_counter() - self._started, 3)
+
+
+# Путь к модулю бота: по нему профайлер находит кадры бота на стеке
+_BOT_FILE = os.path.abspath(__file__)
+
+
+class SamplingProfiler:
+    """Семплирующий профайлер: периодически снимает стек указанного потока из фонового потока.
+
+    Каждый семпл помечается этапом RunTrace, открытым в момент снятия. Пока задача ожидает
+    I/O через await, ее корутины нет на стеке потока: такие семплы показывают простой
+    событийного цикла (selectors.select, base_events._run_once) или чужие задачи aiogram.
+    """
+
+    MIN_INTERVAL_MS = 1
+    DEFAULT_INTERVAL_MS = 10
+
+    def __init__(self, thread_id: int, trace: RunTrace = None, interval_ms: int = None, depth: int = 8):
+        self.thread_id = thread_id
+        self.trace = trace
+        if interval_ms is None:
+            interval_ms = self.interval_from_env()
+        # Нулевой интервал превратил бы семплирование в цикл, удерживающий GIL
+        self.interval = max(interval_ms, self.MIN_INTERVAL_MS) / 1000
+        self.depth = depth
+        self.samples = Counter()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def interval_from_env(cls) -> int:
+        """Читает PROFILER_INTERVAL_MS, при некорректном значении использует значение по умолчанию"""
+        try:
+            return int(os.getenv("PROFILER_INTERVAL_MS", cls.DEFAULT_INTERVAL_MS))
+        except ValueError:
+            logger.warning("Некорректное значение PROFILER_INTERVAL_MS, используется значение по умолчанию")
+            return cls.DEFAULT_INTERVAL_MS
+
+    def start(self):
+        self._thread = Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stage = (self.trace.current_stage if self.trace else None) or "-"
+            self.samples[(stage, self._format_stack(frame))] += 1
+
+    def _format_stack(self, frame) -> str:
+        """Сворачивает стек до самого глубокого кадра bot.py и нескольких кадров под ним"""
+        frames = []
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.f_back
+        anchor = next(
+            (i for i, f in enumerate(frames) if os.path.abspath(f.f_code.co_filename) == _BOT_FILE),
+            None
+        )
+        if anchor is None:
+            # Кадров бота нет на стеке — поток ждет в событийном цикле или занят чужой задачей
+            kept = frames[:self.depth]
+        elif anchor < self.depth:
+            kept = frames[:anchor + 1]
+        else:
+            # Глубокий стек библиотеки: оставляем листовые кадры и кадр бота, из которого они вызваны
+            kept = frames[:self.depth - 1] + [None, frames[anchor]]
+        return " <- ".join(
+            "..." if f is None else
+            f"{os.path.basename(f.f_code.co_filename)}:{f.f_lineno} {f.f_code.co_name}"
+            for f in kept
+        )
+
+    def top(self, limit: int = 10) -> list:
+        """Возвращает самые частые стеки с этапом и долей семплов в процентах"""
+        total = sum(self.samples.values())
+        return [
+            {"stage": stage, "stack": stack, "samples": count, "percent": round(count * 100 / total, 1)}
+            for (stage, stack), count in self.samples.most_common(limit)
+        ]
+
+
+# Включается и выключается командой /profile
+profiling_enabled = False
+
+
+class YtDlpLogger:
+    """Перенаправляет вывод yt-dlp в логирование вместо stdout"""
+
+    def __init__(self):
+        self._logger = logging.getLogger("yt_dlp")
+
+    def debug(self, msg):
+        self._logger.debug(msg)
+
+    def info(self, msg):
+        self._logger.debug(msg)
+
+    def warning(self, msg):
+        self._logger.warning(msg)
+
+    def error(self, msg):
+        self._logger.error(msg)
+
+
 async def download_video(url: str, output_path: str = "downloads") -> str:
     """Скачивает видео с TikTok по URL"""
     Path(output_path).mkdir(exist_ok=True)
@@ -116,8 +362,10 @@ async def download_video(url: str, output_path: str = "downloads") -> str:
     ydl_opts = {
         'format': 'best',
         'outtmpl': f'{output_path}/%(id)s.%(ext)s',
-        'quiet': False,
+        'quiet': True,
+        'noprogress': True,
         'no_warnings': False,
+        'logger': YtDlpLogger(),
     }
     
     try:
@@ -177,38 +425,52 @@ async def get_random_tiktok_url():
 async def post_random_video():
     """Публикует случайное видео из TikTok"""
     import gc
+    trace = RunTrace()
+    trace_token = current_trace_id.set(trace.trace_id)
+    status = "error"
+    profiler = None
+    if profiling_enabled:
+        profiler = SamplingProfiler(threading.get_ident(), trace)
+        profiler.start()
     try:
         logger.info("Начало выполнения задачи post_random_video")
         # Получаем URL случайного видео
-        video_url = await get_random_tiktok_url()
+        with trace.stage("select"):
+            video_url = await get_random_tiktok_url()
         if not video_url:
             logger.warning("Не удалось получить URL случайного видео")
+            status = "no_video"
             return
 
         logger.info(f"Получен URL видео: {video_url}")
         
         # Скачиваем видео
-        video_path = await download_video(video_url)
+        with trace.stage("download"):
+            video_path = await download_video(video_url)
         if not video_path:
             logger.error("Не удалось скачать видео по URL")
+            status = "download_failed"
             return
 
         logger.info(f"Видео скачано: {video_path}")
         
         # Отправляем видео в канал
         try:
-            await bot.send_video(
-                chat_id=CHANNEL_ID,
-                video=FSInputFile(video_path)
-            )
+            with trace.stage("send"):
+                await bot.send_video(
+                    chat_id=CHANNEL_ID,
+                    video=FSInputFile(video_path)
+                )
             logger.info(f"✓ Случайное видео опубликовано из: {video_url}")
             
             # Добавляем URL видео в базу данных после успешной отправки
-            DatabaseManager.add_posted_video(video_url)
+            with trace.stage("db"):
+                DatabaseManager.add_posted_video(video_url)
             logger.info(f"Видео {video_url} добавлено в базу данных.")
             
         except Exception as e:
             logger.error(f"Ошибка при отправке видео в канал: {e}")
+            status = "send_failed"
             # Удаляем файл даже если отправка не удалась
             try:
                 os.remove(video_path)
@@ -217,6 +479,7 @@ async def post_random_video():
                 logger.error(f"Ошибка при удалении файла: {remove_error}")
             return
 
+        status = "posted"
         # Удаляем локальный файл после успешной отправки
         try:
             os.remove(video_path)
@@ -228,8 +491,17 @@ async def post_random_video():
         logger.error(f"Ошибка в функции post_random_video: {e}")
     finally:
         # Освобождаем память
-        gc.collect()
-        logger.info("Завершение выполнения задачи post_random_video")
+        with trace.stage("gc"):
+            gc.collect()
+        extra = {"status": status, "stages": trace.stages, "total_seconds": trace.total}
+        if profiler:
+            profiler.stop()
+            extra["profile"] = profiler.top()
+        logger.info(
+            f"Завершение выполнения задачи post_random_video ({status}, {extra['total_seconds']} с)",
+            extra=extra
+        )
+        current_trace_id.reset(trace_token)
 
 
 @dp.message(Command("start"))
@@ -270,6 +542,7 @@ async def cmd_help(message: types.Message):
         "/add_post - добавить видео\n"
         "/delete_post - удалить пост\n"
         "/list_posts - список опубликованных видео\n"
+        "/profile - включить/выключить профилирование публикаций\n"
         "/help - справка\n"
         "Бот автоматически публикует трендовые видео с TikTok в канал."
     )
@@ -378,6 +651,24 @@ async def cmd_list_posts(message: types.Message):
         await message.answer("📭 Нет опубликованных видео")
 
 
+@dp.message(Command("profile"))
+async def cmd_profile(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ У вас нет доступа к этой команде")
+        return
+
+    global profiling_enabled
+    profiling_enabled = not profiling_enabled
+    logger.info(f"Профилирование post_random_video {'включено' if profiling_enabled else 'выключено'}")
+    if profiling_enabled:
+        await message.answer(
+            "🔬 Профилирование включено.\n"
+            "Результаты каждой публикации записываются в лог (поле profile)."
+        )
+    else:
+        await message.answer("🔬 Профилирование выключено")
+
+
 async def save_session_state(api, session_file="tiktok_session.json", session_index=0):
     """Сохраняет состояние сессии TikTok в файл"""
     try:
@@ -1,24 +1,34 @@
+import os
 import subprocess
 import sys
 
-# Запускаем бота с перенаправлением вывода в файл
-with open('bot_output.log', 'w', encoding='utf-8') as log_file:
-    process = subprocess.Popen(
-        [sys.executable, 'bot.py'],
-        stdout=log_file,
-        stderr=log_file,
-        universal_newlines=True,
-        bufsize=1
-    )
-    
-    # Ждем завершения процесса (или вручную остановим)
-    print(f"Бот запущен с PID {process.pid}. Логи записываются в bot_output.log")
-    print("Для остановки нажмите Ctrl+C")
-    
-    try:
-        process.wait()
-    except KeyboardInterrupt:
-        print("\nОстанавливаем бота...")
-        process.terminate()
-        process.wait()
-        print("Бот остановлен.")
\ No newline at end of file
+from dotenv import load_dotenv
+
+# Загружаем .env заранее, чтобы настройки логирования из него не перекрывались значениями по умолчанию ниже
+load_dotenv()
+
+# Логи пишет сам бот в ротируемый файл (см. LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT)
+env = os.environ.copy()
+env.setdefault('LOG_FILE', 'bot_output.log')
+env.setdefault('LOG_TO_CONSOLE', 'false')
+
+# Запускаем бота
+process = subprocess.Popen(
+    [sys.executable, 'bot.py'],
+    env=env
+)
+
+# Ждем завершения процесса (или вручную остановим)
+if env['LOG_FILE']:
+    print(f"Бот запущен с PID {process.pid}. Логи записываются в {env['LOG_FILE']}")
+else:
+    print(f"Бот запущен с PID {process.pid}. Запись логов в файл отключена (LOG_FILE пуст)")
+print("Для остановки нажмите Ctrl+C")
+
+try:
+    process.wait()
+except KeyboardInterrupt:
+    print("\nОстанавливаем бота...")
+    process.terminate()
+    process.wait()
+    print("Бот остановлен.")